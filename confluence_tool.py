@@ -2,8 +2,20 @@ import sys
 import argparse
 import json
 import os
+import re
+import sqlite3
+import threading
+import time
+import functools
+import requests
+import html
 from atlassian import Confluence
+from auth import get_auth_header
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from urllib3.util.retry import Retry
 
 # --- CONFIGURATION: Retrieve from Environment Variables ---
 try:
@@ -15,29 +27,311 @@ except KeyError as e:
     sys.exit(1)
 
 MAX_RESULTS = 10 # Increase results limit for local filtering approach
+FETCH_WORKERS = 16 # Concurrent body fetches in the local filtering fallback
+BULK_CHUNK_SIZE = 250 # Page ids per CQL `id in (...)` bulk lookup
+PAGE_CACHE_PATH = os.path.expanduser('~/.cache/confluence_tool/pages-v4.sqlite3') # Bump when the cached text format changes
+PAGE_CACHE_TTL = 86400 # Seconds a cached page body or text stays valid on disk
+PAGE_CACHE_TABLES = ('bodies', 'texts') # Raw storage bodies, and their tag-stripped text
+SPACE_KEYS_TTL = 3600 # Seconds the list of space keys is reused before re-enumerating
+V2_PAGE_LIMIT = 250 # Page size for cursor-paginated v2 listings (the API maximum)
+LOCAL_SCAN_MAX_PAGES = 5000 # Spaces larger than this are too slow to enumerate in the local fallback
+REQUEST_TIMEOUT = 15 # Seconds per HTTP request (the library default is 75)
+SEARCH_DEADLINE_SECONDS = 40 # The local fallback stops scanning after this, so a search ends within the UI's 60 s limit
+
+_client = None
+_page_cache_conn = None
+_page_cache_lock = threading.Lock()
+_space_keys_cache = (0.0, []) # (expiry timestamp, space keys)
 
 def get_confluence_client():
-    """Initializes and returns the Confluence client."""
-    return Confluence(
-        url=CONFLUENCE_URL,
-        username=USERNAME,
-        password=API_TOKEN,
-        cloud=True
-    )
+    """
+    Returns the shared Confluence client, creating it on first use so every
+    call reuses the same pooled keep-alive connections.
+    """
+    global _client
+    if _client is None:
+        session = requests.Session()
+        # Basic auth header is encoded once (in auth.py) instead of on every request
+        session.headers.update(get_auth_header())
+        # Size the connection pool so concurrent body fetches don't queue on (or discard) connections
+        session.mount('https://', HTTPAdapter(
+            pool_connections=FETCH_WORKERS,
+            pool_maxsize=FETCH_WORKERS,
+            # Read timeouts aren't retried: a hung request would otherwise cost REQUEST_TIMEOUT several times over
+            max_retries=Retry(total=3, read=0, backoff_factor=0.2, status_forcelist=(429, 502, 503, 504))
+        ))
+        _client = Confluence(url=CONFLUENCE_URL, session=session, cloud=True, timeout=REQUEST_TIMEOUT)
+    return _client
+
+def _escape_cql(value):
+    """Escapes backslashes and double quotes so the value is safe inside a CQL string literal."""
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+def _format_updated(page):
+    """Returns the page's last-updated timestamp as 'YYYY-MM-DD HH:MM:SS', or 'N/A'."""
+    # v1 content carries history.lastUpdated; v2 pages carry the current version's createdAt
+    updated_raw = (page.get('history', {}).get('lastUpdated', {}).get('when')
+                   or page.get('version', {}).get('createdAt', 'N/A'))
+    updated = 'N/A'
+    if updated_raw != 'N/A':
+        # Confluence emits 'YYYY-MM-DDTHH:MM:SS.mmmZ', so slicing yields the same string without building a datetime
+        if len(updated_raw) >= 19 and updated_raw[4] == '-' and updated_raw[10] == 'T':
+            updated = f"{updated_raw[:10]} {updated_raw[11:19]}"
+        else:
+            # Only malformed or unusual timestamps pay for a full parse
+            try:
+                updated = datetime.fromisoformat(updated_raw.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M:%S')
+            except (ValueError, TypeError, AttributeError):
+                pass
+    return updated
 
-# 💥 The new default search function is the robust, local filtering logic.
-def search_and_report_updates(search_term, space_key=None):
+# 💥 The default search: a single server-side CQL query with the needed fields expanded.
+def search_and_report_updates(search_term, space_key=None, since=None):
     """
-    Pulls all pages from specified space(s) and filters locally 
-    to avoid strict CQL parser errors.
+    Runs one CQL `text ~` search so Confluence matches title and body server-side
+    and returns space and history in the same response. If `since` (YYYY-MM-DD)
+    is given, only pages modified after it are reported. Falls back to local
+    filtering if the CQL query is rejected.
     """
+    deadline = time.monotonic() + SEARCH_DEADLINE_SECONDS
     try:
         confluence = get_confluence_client()
     except Exception as e:
         return {"error": f"Connection failed: {e}"}
 
+    search_term = search_term.strip('"') # Strip quotes if present
+    scope_message = f"in Space: {space_key}" if space_key else "across ALL Spaces"
+    if since:
+        scope_message += f", modified after {since}"
+
+    cql = f'type = page AND text ~ "{_escape_cql(search_term)}"'
+    if space_key:
+        cql += f' AND space = "{_escape_cql(space_key)}"'
+    if since:
+        # lastModified is index-backed, so unchanged pages are excluded server-side
+        cql += f' AND lastModified > "{_escape_cql(since)}"'
+    sys.stderr.write(f"🔎 Executing CQL Search {scope_message} | CQL: {cql}\n")
+
+    try:
+        response = confluence.get(
+            'rest/api/content/search',
+            params={'cql': cql, 'expand': 'space,history.lastUpdated', 'limit': MAX_RESULTS}
+        ) or {}
+    except requests.HTTPError as e:
+        # Only a CQL parser rejection (400) is worth the expensive local scan
+        if e.response is None or e.response.status_code != 400:
+            return {"error": f"Search failed: {e}"}
+        sys.stderr.write(f"Warning: CQL search rejected ({e}). Falling back to local filtering.\n")
+        return search_with_local_filter(confluence, search_term, space_key, since, deadline)
+    except Exception as e:
+        return {"error": f"Search failed: {e}"}
+
+    matches = [{
+        "title": p.get('title', ''),
+        "id": p.get('id', 'N/A'),
+        "space_key": p.get('space', {}).get('key', space_key or 'N/A'),
+        "last_updated": _format_updated(p)
+    } for p in response.get('results', [])[:MAX_RESULTS]]
+
+    return {
+        "query": search_term,
+        "scope": scope_message,
+        "total_matches": len(matches),
+        "matches": matches
+    }
+
+def _get_space_keys_cached(confluence):
+    """Returns all space keys, re-enumerating at most once per SPACE_KEYS_TTL."""
+    global _space_keys_cache
+    expires, keys = _space_keys_cache
+    if time.time() >= expires:
+        keys = [s['key'] for s in confluence.get_all_spaces().get('results', [])]
+        _space_keys_cache = (time.time() + SPACE_KEYS_TTL, keys)
+    return keys
+
+def _get_space_id(confluence, space_key):
+    """Resolves a space key to the numeric id the v2 API expects."""
+    results = (confluence.get('api/v2/spaces', params={'keys': space_key}) or {}).get('results', [])
+    if not results:
+        raise ValueError(f"Space '{space_key}' not found.")
+    return results[0]['id']
+
+def _space_page_count(confluence, space_key):
+    """Returns the number of pages in a space from a count-only CQL query, or None if unknown."""
+    try:
+        response = confluence.get(
+            'rest/api/content/search',
+            params={'cql': f'space = "{_escape_cql(space_key)}" AND type = page', 'limit': 0}
+        ) or {}
+    except Exception as e:
+        sys.stderr.write(f"Warning: Could not count pages in space {space_key}: {e}\n")
+        return None
+    return response.get('totalSize')
+
+def _iter_pages_v2(confluence, space_id, body_format=None):
+    """
+    Yields pages (id, title, version and, if body_format is given, the body)
+    for a space using the v2 cursor API, which stays fast on large spaces
+    where v1 offset paging degrades.
+    """
+    params = {'limit': V2_PAGE_LIMIT}
+    if body_format:
+        params['body-format'] = body_format
+    response = confluence.get(f'api/v2/spaces/{space_id}/pages', params=params) or {}
+    while True:
+        yield from response.get('results', [])
+        next_link = response.get('_links', {}).get('next')
+        if not next_link:
+            break
+        # The next link is site-relative and already carries the cursor
+        response = confluence.get(urljoin(CONFLUENCE_URL, next_link), absolute=True) or {}
+
+def _get_page_cache():
+    """Opens (once) the on-disk page cache and purges expired entries."""
+    global _page_cache_conn
+    if _page_cache_conn is None:
+        os.makedirs(os.path.dirname(PAGE_CACHE_PATH), exist_ok=True)
+        conn = sqlite3.connect(PAGE_CACHE_PATH, check_same_thread=False)
+        for table in PAGE_CACHE_TABLES:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "page_id TEXT PRIMARY KEY, version INTEGER NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute(f"DELETE FROM {table} WHERE expires < ?", (time.time(),))
+        conn.commit()
+        _page_cache_conn = conn
+    return _page_cache_conn
+
+def _page_cache_get(table, page_id, version):
+    """Returns the cached value for this exact page version, or None on a miss."""
+    try:
+        with _page_cache_lock:
+            row = _get_page_cache().execute(
+                f"SELECT value FROM {table} WHERE page_id = ? AND version = ? AND expires >= ?",
+                (page_id, version, time.time())
+            ).fetchone()
+    except (sqlite3.Error, OSError) as e:
+        sys.stderr.write(f"Warning: Page cache read failed: {e}\n")
+        return None
+    return row[0] if row else None
+
+def _page_cache_set(table, rows):
+    """
+    Stores (page_id, version, value) rows in one transaction, replacing any
+    older version of the same pages.
+    """
+    if not rows:
+        return
+    expires = time.time() + PAGE_CACHE_TTL
+    try:
+        with _page_cache_lock:
+            conn = _get_page_cache()
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} (page_id, version, value, expires) VALUES (?, ?, ?, ?)",
+                [(page_id, version, value, expires) for page_id, version, value in rows]
+            )
+            conn.commit()
+    except (sqlite3.Error, OSError) as e:
+        sys.stderr.write(f"Warning: Page cache write failed: {e}\n")
+
+# CDATA is split out first: it's literal text (code and no-format macro bodies) that may contain '<'
+_CDATA_RE = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]*>')
+
+def _to_text(storage_xhtml):
+    """
+    Returns the text content of a storage-format body. Tags become spaces so
+    words in adjacent elements don't run together.
+    """
+    parts = _CDATA_RE.split(storage_xhtml)
+    # Even indices are markup, odd ones are CDATA contents
+    parts[::2] = [html.unescape(_TAG_RE.sub(' ', markup)) for markup in parts[::2]]
+    return ' '.join(parts)
+
+def _page_text(page_id, version, body, new_texts):
+    """
+    Returns the lowercased text form of a page body, reusing the cached copy
+    for this version. Freshly stripped texts are appended to new_texts so the
+    caller can store them in one batched write.
+    """
+    text = _page_cache_get('texts', page_id, version) if version is not None else None
+    if text is None:
+        # Stored lowercased so matching is a plain substring check with no per-scan copy
+        text = _to_text(body).lower()
+        if version is not None:
+            new_texts.append((page_id, version, text))
+    return text
+
+@functools.lru_cache(maxsize=512)
+def _get_body(confluence, page_id, version):
+    """
+    In-process (L1) cache in front of the on-disk (L2) cache. A page body only
+    changes when its version number does, so (id, version) is a safe key.
+    Raises on fetch failure so errors are never cached.
+    """
+    body = _page_cache_get('bodies', page_id, version)
+    if body is None:
+        body = confluence.get_page_by_id(page_id, expand='body.storage').get('body', {}).get('storage', {}).get('value', '')
+        _page_cache_set('bodies', [(page_id, version, body)])
+    return body
+
+def _get_pages_chunk(confluence, ids, expand):
+    """Fetches one chunk of pages by id, following pagination if the server caps the page size."""
+    response = confluence.get(
+        'rest/api/content/search',
+        params={'cql': f"id in ({','.join(ids)})", 'expand': expand, 'limit': len(ids)}
+    ) or {}
+    results = list(response.get('results', []))
+    while response.get('_links', {}).get('next'):
+        # v1 next links are relative to _links.base
+        next_url = response['_links'].get('base', CONFLUENCE_URL) + response['_links']['next']
+        response = confluence.get(next_url, absolute=True) or {}
+        results.extend(response.get('results', []))
+    return results
+
+def _bulk_get_pages(confluence, ids, expand='body.storage,version'):
+    """
+    Yields content objects for many page ids using CQL `id in (...)` lookups of
+    BULK_CHUNK_SIZE ids each, run concurrently, instead of one request per page.
+    """
+    chunks = [ids[i:i + BULK_CHUNK_SIZE] for i in range(0, len(ids), BULK_CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        futures = [executor.submit(_get_pages_chunk, confluence, chunk, expand) for chunk in chunks]
+        try:
+            for future in as_completed(futures):
+                try:
+                    pages = future.result()
+                except Exception as e:
+                    sys.stderr.write(f"Warning: Could not fetch a chunk of page bodies: {e}\n")
+                    continue
+                yield from pages
+        finally:
+            # The caller may stop early; drop chunks that haven't started yet
+            for f in futures:
+                f.cancel()
+
+def _local_match(page, space_key):
+    """Builds a match entry from page metadata found by the local filter."""
+    return {
+        "title": page.get('title', ''),
+        "id": page.get('id', 'N/A'),
+        "space_key": space_key,
+        "last_updated": _format_updated(page)
+    }
+
+def search_with_local_filter(confluence, search_term, space_key=None, since=None, deadline=None):
+    """
+    Pulls all pages from specified space(s) and filters locally 
+    to avoid strict CQL parser errors. If a deadline (time.monotonic() value)
+    is given, the scan stops there and reports what it has found so far.
+    """
     matches = []
+    # Cached texts are already lowercased, so matching is a plain substring check.
+    # The term arrives already stripped of quotes by search_and_report_updates.
+    search_lower = search_term.lower()
     scope_message = f"in Space: {space_key}" if space_key else "across ALL Spaces"
+    if since:
+        scope_message += f", modified after {since}"
     sys.stderr.write(f"🔎 Executing FALLBACK Search {scope_message} | Term: {search_term}\n")
 
     try:
@@ -45,50 +339,77 @@ def search_and_report_updates(search_term, space_key=None):
         if space_key:
             spaces = [space_key]
         else:
-            # Note: Getting ALL spaces can be slow/resource-intensive
-            spaces = [s['key'] for s in confluence.get_all_spaces().get('results', [])]
+            # Note: Getting ALL spaces can be slow/resource-intensive, so the keys are cached
+            spaces = _get_space_keys_cached(confluence)
 
+        timed_out = False
         for sk in spaces:
-            # Get pages metadata
-            pages = confluence.get_all_pages_from_space(sk, start=0, limit=1000)
-            
+            if deadline is not None and time.monotonic() > deadline:
+                timed_out = True
+                break
+
+            # Enumerating very large spaces is pathologically slow, so check the size first
+            page_count = _space_page_count(confluence, sk)
+            if page_count is not None and page_count > LOCAL_SCAN_MAX_PAGES:
+                if space_key:
+                    return {"error": f"Space '{sk}' has {page_count} pages, too many to scan locally. Try a simpler search term so the CQL search can run."}
+                sys.stderr.write(f"Warning: Skipping space {sk} ({page_count} pages) in the local scan.\n")
+                continue
+
+            # Bodies arrive with the listing, so one call covers up to V2_PAGE_LIMIT pages
+            pages = _iter_pages_v2(confluence, _get_space_id(confluence, sk), body_format='storage')
+
+            # Only pages the listing returned without a body need a separate fetch
+            body_candidates = []
+            new_texts = []
             for p in pages:
-                title = p.get('title', '')
-                
-                # Fetch full content to search the body
-                try:
-                    # Note: We are fetching content for every page in the loop. This is slow but robust.
-                    body = confluence.get_page_by_id(p.get('id'), expand='body.storage').get('body', {}).get('storage', {}).get('value', '')
-                except Exception as e:
-                    sys.stderr.write(f"Warning: Could not fetch content for page {p.get('id')}: {e}\n")
-                    body = ''
-
-                # Local filtering on title and body
-                search_lower = search_term.strip('"').lower() # Strip quotes if present
-                if search_lower in title.lower() or search_lower in body.lower():
-                    
-                    # Formatting logic
-                    history = p.get('history', {})
-                    updated_raw = history.get('lastUpdated', {}).get('when', 'N/A')
-                    updated = 'N/A'
-                    if updated_raw != 'N/A':
-                        try:
-                            updated = datetime.fromisoformat(updated_raw.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M:%S')
-                        except:
-                            pass
-                            
-                    matches.append({
-                        "title": title,
-                        "id": p.get('id', 'N/A'),
-                        "space_key": sk,
-                        "last_updated": updated
-                    })
-                    
-                if len(matches) >= MAX_RESULTS:
+                # Checked per page: each step of the listing may be another request
+                if deadline is not None and time.monotonic() > deadline:
+                    timed_out = True
                     break
-            if len(matches) >= MAX_RESULTS:
+                if since:
+                    # 'YYYY-MM-DD HH:MM:SS' compares correctly against 'YYYY-MM-DD' as a string
+                    updated = _format_updated(p)
+                    if updated == 'N/A' or updated <= since:
+                        continue
+                body = p.get('body', {}).get('storage', {}).get('value')
+                version = p.get('version', {}).get('number')
+                # Bodies are matched on their text form so tag and attribute names can't match
+                if search_lower in p.get('title', '').lower() or (
+                    body is not None and search_lower in _page_text(p.get('id'), version, body, new_texts)
+                ):
+                    matches.append(_local_match(p, sk))
+                    if body is not None and version is not None:
+                        # Matches are the pages most likely to be opened next via --content-id
+                        _page_cache_set('bodies', [(p.get('id'), version, body)])
+                    if len(matches) >= MAX_RESULTS:
+                        break
+                elif body is None:
+                    body_candidates.append(p)
+
+            # Bodies the listing didn't include are fetched in bulk, ceil(N / BULK_CHUNK_SIZE) requests
+            listed = {p.get('id'): p for p in body_candidates}
+            if len(matches) < MAX_RESULTS and not timed_out:
+                for page in _bulk_get_pages(confluence, list(listed)):
+                    if deadline is not None and time.monotonic() > deadline:
+                        # Leaving the generator cancels the chunks that haven't started
+                        timed_out = True
+                        break
+                    body = page.get('body', {}).get('storage', {}).get('value', '')
+                    if search_lower in _page_text(page.get('id'), page.get('version', {}).get('number'), body, new_texts):
+                        matches.append(_local_match(listed.get(page.get('id'), page), sk))
+                        if len(matches) >= MAX_RESULTS:
+                            break
+
+            _page_cache_set('texts', new_texts)
+            if len(matches) >= MAX_RESULTS or timed_out:
                 break
 
+        if timed_out:
+            if not matches:
+                return {"error": f"Local search stopped after {SEARCH_DEADLINE_SECONDS} seconds. Try a more specific term or limit it to one space."}
+            scope_message += f" (partial: stopped after {SEARCH_DEADLINE_SECONDS} seconds)"
+
         return {
             "query": search_term,
             "scope": scope_message,
@@ -99,35 +420,96 @@ def search_and_report_updates(search_term, space_key=None):
         return {"error": f"Search failed: {e}"}
 
 def get_page_content_by_id(page_id):
-    """Fetches the title and full storage content of a specific Confluence page."""
+    """
+    Fetches the title and full storage content of a specific Confluence page.
+    Only the version metadata is requested up front; the body comes from the
+    (id, version) page cache unless this version hasn't been seen before.
+    """
     try:
         confluence = get_confluence_client()
-        page_data = confluence.get_page_by_id(page_id, expand='body.storage')
-        content = page_data.get('body', {}).get('storage', {}).get('value', 'Content not found.')
+        page_data = confluence.get_page_by_id(page_id, expand='version')
         title = page_data.get('title', 'Untitled Page')
+        version = page_data.get('version', {}).get('number')
+
+        if version is None:
+            content = confluence.get_page_by_id(page_id, expand='body.storage').get('body', {}).get('storage', {}).get('value', 'Content not found.')
+        else:
+            content = _get_body(confluence, str(page_id), version)
         
         return {"title": title, "content": content}
     except Exception as e:
         return {"error": f"Failed to retrieve content for ID {page_id}: {e}"}
 
-# --- COMMAND-LINE EXECUTION LOGIC ---
-if __name__ == "__main__":
+def _iso_date(value):
+    """argparse type for --since: accepts YYYY-MM-DD and returns it unchanged."""
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{value}', expected YYYY-MM-DD")
+    return value
+
+def run_batch(ops):
+    """
+    Runs a list of {"op": "search", "term", "space", "since"} / {"op": "content", "id"}
+    operations concurrently on the shared client and returns their results in order.
+    """
+    def run_op(op):
+        # Batch input skips argparse, so apply the same checks the CLI flags get
+        if op.get('op') == 'content' and op.get('id') and isinstance(op['id'], str):
+            return get_page_content_by_id(op['id'])
+        if (op.get('op') == 'search' and op.get('term') and isinstance(op['term'], str)
+                and isinstance(op.get('space') or '', str) and isinstance(op.get('since') or '', str)):
+            since = op.get('since')
+            if since:
+                try:
+                    since = _iso_date(since)
+                except argparse.ArgumentTypeError as e:
+                    return {"error": f"Invalid batch operation {op}: {e}"}
+            return search_and_report_updates(op['term'].strip('"'), op.get('space'), since)
+        return {"error": f"Invalid batch operation: {op}"}
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        return list(executor.map(run_op, ops))
+
+def run_command(argv=None):
+    """
+    Parses CLI-style arguments and runs the requested operation, returning the
+    JSON-ready result. Shared by the command line and in-process callers.
+    """
     parser = argparse.ArgumentParser(description="Confluence Search and Report Tool.")
     
     # Define all possible arguments
     parser.add_argument('--search', help='The text string to search for.', required=False)
     parser.add_argument('--space', default=None, help='The key of the space to search (optional).')
     parser.add_argument('--content-id', default=None, help='Page ID to retrieve full content for analysis.') 
+    parser.add_argument('--since', default=None, type=_iso_date, help='Only report pages modified after this date, YYYY-MM-DD (optional).')
+    parser.add_argument('--batch', default=None, help='JSON list of search/content operations to run in one invocation ("-" reads it from stdin).')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+
+    # A batch returns a list of results, one per operation
+    if args.batch:
+        try:
+            ops = json.loads(sys.stdin.read() if args.batch == '-' else args.batch)
+        except json.JSONDecodeError as e:
+            return {"error": f"Invalid --batch JSON: {e}"}
+        if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+            return {"error": "--batch must be a JSON list of operation objects."}
+        return run_batch(ops)
 
     # Conditional logic to prioritize content retrieval
     if args.content_id:
-        result = get_page_content_by_id(args.content_id)
+        return get_page_content_by_id(args.content_id)
     elif args.search:
-        # Calls the robust local filtering function
-        result = search_and_report_updates(args.search.strip('"'), args.space) 
+        # Server-side CQL search (falls back to local filtering on CQL errors)
+        return search_and_report_updates(args.search.strip('"'), args.space, args.since)
     else:
-        result = {"error": "Missing search term or page ID argument."}
+        return {"error": "Missing search term or page ID argument."}
+
+# --- COMMAND-LINE EXECUTION LOGIC ---
+if __name__ == "__main__":
+    result = run_command()
 
-    print(json.dumps(result, indent=4))
+    # Serialize straight into the stdout buffer instead of building the whole string first
+    json.dump(result, sys.stdout, indent=4)
+    sys.stdout.write("\n")
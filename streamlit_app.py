@@ -1,11 +1,14 @@
 import streamlit as st
-import subprocess
-import json
 import os
 import re
+import hashlib
+import difflib
+import collections
+import string
 from google import genai
 from google.genai.errors import APIError
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import time 
 
 # --- Configuration & Setup ---
@@ -18,7 +21,12 @@ except Exception:
 if not GEMINI_API_KEY:
     st.sidebar.error("❌ GEMINI_API_KEY environment variable not found. Analysis functions disabled.")
 
-CONFLUENCE_SCRIPT = "confluence_tool.py"
+@st.cache_resource(show_spinner=False)
+def get_gemini_client(api_key):
+    """Builds the Gemini client once per process; Streamlit reruns reuse it and its HTTP connection pool."""
+    return genai.Client(api_key=api_key)
+
+_GEMINI_CLIENT = get_gemini_client(GEMINI_API_KEY) if GEMINI_API_KEY else None
 
 try:
     CONFLUENCE_BASE_URL = os.environ['CONFLUENCE_URL']
@@ -28,21 +36,108 @@ except KeyError:
     CONFLUENCE_BASE_URL = "https://YOUR_CONFLUENCE_URL_NOT_SET"
 
 
-STOP_WORDS = set([
+STOP_WORDS = frozenset([
     'a', 'an', 'the', 'for', 'about', 'and', 'or', 'in', 'on', 'with',
     'is', 'are', 'was', 'were', 'of', 'to', 'from', 'can', 'should', 'i',
     'my', 'find', 'show', 'search', 'documentation', 'notes', 'tell',
     'need', 'looking', 'me', 'you', 'give'
 ])
 
+# Compiled once; extract_search_params runs on every search submit
+_SPACE_RE = re.compile(r'in space\s+([A-Z0-9]{2,10})\b', re.IGNORECASE)
+_PUNCT_RE = re.compile(r'[^\w\s]')
+# Removes every stop word in one C-level pass (input is already lowercased)
+_STOPWORD_RE = re.compile(r'\b(?:' + '|'.join(map(re.escape, sorted(STOP_WORDS))) + r')\b')
+
+PREFETCH_CANDIDATES = 3 # Top matches whose content is fetched while the LLM ranks them
+RANKING_MODEL = 'gemini-2.5-flash-lite' # Picking one of a few candidates is a small classification task
+LLM_RANKING_MIN_MATCHES = 4 # With fewer matches, the latest updated page is chosen without an LLM call
+RECENCY_WEIGHT = 0.5 # Weight of recency against title similarity in the local page score
+LOCAL_SCORE_MARGIN = 1.3 # The local winner is used without the LLM if it beats the runner-up by this factor
+GEMINI_CACHE_TTL_SECONDS = 600 # Lifetime of an explicit Gemini cache holding a page's content
+GEMINI_CACHE_MIN_TOKENS = 2048 # Explicit caching rejects smaller contexts
+CONFLUENCE_TIMEOUT_SECONDS = 60 # Overall limit for one Confluence action, as the old subprocess call had
+
+_ACTIONS = (
+    "Propose Content Update",
+    "Improve Formatting & Readability",
+    "Fix Grammar & Spelling",
+    "Just perform a Content Quality Audit (No changes proposed)"
+)
+_ACTION_IDX = {action: i for i, action in enumerate(_ACTIONS)}
+
+# --- Prompt Templates ---
+
+ACTION_PROMPTS = {
+    'Fix Grammar & Spelling': string.Template(
+        "Review the page content and correct all grammatical errors, typos, and spelling mistakes. Do NOT change the meaning or structure. Return ONLY the corrected page content."),
+    
+    'Improve Formatting & Readability': string.Template(
+        "Review the page content (which is in Confluence Storage Format/HTML). Reformat it to be easier to read, using clear headings and lists. Do NOT change the meaning or core text. Return ONLY the improved page content."),
+        
+    'Propose Content Update': string.Template(
+        "Review the page content and propose a major update focusing on the search term '$search_term'. Improve clarity, add missing steps, and make the information comprehensive. Include a brief summary of changes at the top. Return ONLY the proposed, fully updated page content."),
+    
+    'Just perform a Content Quality Audit (No changes proposed)': string.Template(
+        "You are a Content Quality Analyst. Analyze the page content and create a detailed Markdown report on its clarity, structure, completeness, and relevance to the search term. Do NOT propose a content change.")
+}
+
+DEFAULT_FORMAT_INSTRUCTION = "The output must be formatted using **standard Markdown**."
+
+FORMAT_INSTRUCTIONS = {
+    "Markdown (Recommended for Review)": DEFAULT_FORMAT_INSTRUCTION,
+    "Confluence Storage Format (HTML/XML - For Direct Paste)":
+        "The output must be formatted using **Confluence Storage Format (HTML/XML)**. Do not include any Markdown text.",
+    "Both Formats (Markdown & HTML/XML)": """The output must contain TWO DISTINCT SECTIONS.
+        1. **MARKDOWN SECTION:** The full proposed content in standard Markdown format.
+        2. **HTML/XML SECTION:** The full proposed content converted into Confluence Storage Format (HTML/XML).
+        Use clear headings to separate the two sections (e.g., '## PROPOSED MARKDOWN' and '## PROPOSED HTML/XML')."""
+}
+
+CUSTOM_CONTENT_TEMPLATE = string.Template("""
+        **CRITICAL NEW CONTENT INPUT:** Integrate the following specific, up-to-date information into the page content:
+        ---
+        CUSTOM CONTENT: $custom_notes
+        ---
+        """)
+
+GUIDELINES_TEMPLATE = string.Template("""
+        **ADDITIONAL STYLISTIC/STRUCTURAL INSTRUCTIONS:** When performing the action, also ensure you follow these specific guidelines:
+        ---
+        GUIDELINES: $optional_instructions
+        ---
+        """)
+
+# Stable, bulky content goes first so re-runs on the same page share a long prefix
+# (implicit Gemini caching) and so it can be moved into an explicit cache as a unit.
+PAGE_BLOCK_TEMPLATE = string.Template("""
+    You are an expert Confluence Content Editor. Your task is to perform the action given after the page content.
+    
+    PAGE TITLE: $page_title
+    
+    RAW PAGE CONTENT (in Confluence Storage Format/HTML):
+    ---
+    $page_content
+    ---
+    """)
+
+# Per-run instructions go last
+TASK_PROMPT_TEMPLATE = string.Template("""
+    Action: '$action_prompt'
+    
+    $custom_instruction 
+    
+    **CRITICAL OUTPUT INSTRUCTION:** You MUST return **ONLY** the result of the action (the proposed content or audit report). Do not include any conversational preamble, confirmation, or explanatory text before the final output. $format_instruction
+    """)
+
 # --- Session State Initialization ---
 
 if 'total_tokens_used' not in st.session_state:
      st.session_state.total_tokens_used = 0
-if 'token_usage' not in st.session_state:
-    st.session_state.token_usage = "0"
+if 'gemini_cache' not in st.session_state:
+    st.session_state.gemini_cache = {}
 if 'search_history' not in st.session_state:
-    st.session_state.search_history = []
+    st.session_state.search_history = collections.deque(maxlen=5) # Oldest query drops off automatically
 if 'analysis_state' not in st.session_state:
     st.session_state.analysis_state = {}
 if 'llm_selected_id' not in st.session_state:
@@ -56,86 +151,138 @@ if 'custom_input_enabled' not in st.session_state:
 
 # --- Helper Functions ---
 
-def run_confluence_command(command_args):
-    """Executes the external Confluence Python script via subprocess."""
-    command = ['python', CONFLUENCE_SCRIPT] + [str(arg) for arg in command_args]
-    
+def _load_confluence_tool():
+    """
+    Imports the Confluence tool, returning (module, None) or (None, error dict).
+    Imported lazily: the tool exits at import time when its credentials are missing.
+    """
     try:
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=60
-        )
-        return json.loads(result.stdout)
+        import confluence_tool
+    except SystemExit:
+        return None, {"error": "Confluence tool could not start. Check that CONFLUENCE_URL, CONFLUENCE_USERNAME and CONFLUENCE_API_TOKEN are set."}
+    except ImportError as e:
+        return None, {"error": f"Confluence tool could not be loaded: {e}"}
+    return confluence_tool, None
 
-    except subprocess.CalledProcessError as e:
-        try:
-            return json.loads(e.stdout)
-        except json.JSONDecodeError:
-            return {"error": f"Confluence script failed. Details: {e.stderr}"}
+
+def _call_with_timeout(fn, *args):
+    """
+    Runs fn(*args) on its own worker thread and waits at most CONFLUENCE_TIMEOUT_SECONDS.
+    Each call gets a fresh thread, so an abandoned call never holds up later ones; the
+    tool's own search deadline and per-request timeout bound how long it keeps running.
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='confluence')
+    try:
+        return executor.submit(fn, *args).result(timeout=CONFLUENCE_TIMEOUT_SECONDS)
+    except FuturesTimeoutError:
+        return {"error": f"Confluence request timed out after {CONFLUENCE_TIMEOUT_SECONDS} seconds."}
+    finally:
+        executor.shutdown(wait=False)
+
+
+def run_confluence_command(command_args):
+    """
+    Runs the Confluence tool in-process with CLI-style arguments. The module stays
+    imported across reruns, so there is no interpreter start-up per call and its
+    HTTP connections and caches are reused.
+    """
+    confluence_tool, error = _load_confluence_tool()
+    if error:
+        return error
+
+    try:
+        return _call_with_timeout(confluence_tool.run_command, [str(arg) for arg in command_args])
+    except SystemExit:
+        return {"error": f"Invalid Confluence command arguments: {command_args}"}
     except Exception as e:
         return {"error": f"An unexpected execution error occurred: {e}"}
 
 
+def run_confluence_batch(ops):
+    """
+    Runs several Confluence operations (see confluence_tool.run_batch) concurrently
+    and returns one result per operation.
+    """
+    confluence_tool, error = _load_confluence_tool()
+    if not error:
+        try:
+            results = _call_with_timeout(confluence_tool.run_batch, ops)
+            if isinstance(results, list):
+                return results
+            error = results
+        except Exception as e:
+            error = {"error": f"An unexpected execution error occurred: {e}"}
+    # The batch as a whole failed; report the same error for every operation
+    return [error] * len(ops)
+
+
 def extract_search_params(user_input):
     """Cleans up the user input to separate the search term from the optional space key."""
-    space_match = re.search(r'in space\s+([A-Z0-9]{2,10})\b', user_input, re.IGNORECASE)
+    space_match = _SPACE_RE.search(user_input)
     space_key = space_match.group(1).upper() if space_match else None
-    search_term_phrase = re.sub(r'in space\s+[A-Z0-9]{2,10}\b', '', user_input, flags=re.IGNORECASE).strip()
+    search_term_phrase = _SPACE_RE.sub('', user_input).strip()
     
-    clean_words = re.sub(r'[^\w\s]', '', search_term_phrase.lower()).split()
-    filtered_words = [word for word in clean_words if word not in STOP_WORDS and len(word) > 2]
-    final_search_term = " ".join(filtered_words)
+    cleaned = _STOPWORD_RE.sub('', _PUNCT_RE.sub('', search_term_phrase.lower()))
+    final_search_term = " ".join(word for word in cleaned.split() if len(word) > 2)
     if not final_search_term:
         final_search_term = search_term_phrase.strip()
         
     return final_search_term, space_key
 
+def parse_date(date_str):
+    """Parses a match's 'last_updated' value, mapping 'N/A' and bad values to datetime.min."""
+    if date_str == 'N/A': return datetime.min 
+    # 'YYYY-MM-DD HH:MM:SS' is an ISO subset, and fromisoformat is much faster than strptime
+    try: return datetime.fromisoformat(date_str)
+    except ValueError: return datetime.min 
+
 def get_latest_updated_match(matches):
     """Finds the match with the most recent update date."""
-    def parse_date(date_str):
-        if date_str == 'N/A': return datetime.min 
-        try: return datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-        except ValueError: return datetime.min 
-    sorted_matches = sorted(
-        matches, 
-        key=lambda m: parse_date(m['last_updated']), 
-        reverse=True
-    )
-    return sorted_matches[0]
+    # A single O(n) pass; no need to sort just to take the first element
+    return max(matches, key=lambda m: parse_date(m['last_updated']))
 
-def get_best_page_recommendation(matches, search_term):
+def score_matches(matches, search_term):
     """
-    Uses the Gemini model to recommend the best page for editing
-    based on perceived quality, latest date, and potential duplication.
+    Cheap pointwise relevance score per match: title similarity to the search term
+    plus a recency bonus that halves for every 30 days behind the newest match.
+    Returns (score, match) pairs, best first.
+    """
+    term = search_term.lower()
+    newest = max(parse_date(m['last_updated']) for m in matches)
+    scored = []
+    for m in matches:
+        title_score = difflib.SequenceMatcher(None, term, m['title'].lower()).ratio()
+        age_days = (newest - parse_date(m['last_updated'])).days
+        scored.append((title_score + RECENCY_WEIGHT * 0.5 ** (age_days / 30), m))
+    return sorted(scored, key=lambda pair: pair[0], reverse=True)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def rank_pages_with_llm(match_keys, search_term):
+    """
+    Asks Gemini to pick the best page among `match_keys`, a tuple of
+    (id, title, space_key, last_updated) tuples, and returns (page_id, justification).
+    Cached per candidate set and search term, so re-running a search from history
+    doesn't repeat the call. Raises on failure so errors are never cached.
     """
-    
     page_details = []
-    options_map = {}
-    for i, m in enumerate(matches):
+    for i, (page_id, title, space_key, last_updated) in enumerate(match_keys):
         detail = (
             f"Page {i+1}:\n"
-            f"  - ID: {m['id']}\n"
-            f"  - Title: '{m['title']}'\n"
-            f"  - Space: '{m['space_key']}'\n"
-            f"  - Last Updated: {m['last_updated']}\n"
+            f"  - ID: {page_id}\n"
+            f"  - Title: '{title}'\n"
+            f"  - Space: '{space_key}'\n"
+            f"  - Last Updated: {last_updated}\n"
         )
         page_details.append(detail)
-        options_map[m['id']] = m 
         
     page_list = "\n".join(page_details)
 
+    # Static instructions first, then the candidates, then the query: searches share the longest possible prefix
     prompt = f"""
-    You are a Content Analyst. I found {len(matches)} pages relevant to the search query: '{search_term}'.
+    You are a Content Analyst. You will be given pages found for a user's search query.
     Your goal is to suggest the absolute **BEST** page for the user to edit to fix or update the information, prioritizing quality and accuracy.
 
-    Here are the page details:
-    ---
-    {page_list}
-    ---
-
     Perform the following analysis steps:
     1.  **LATEST:** Identify the page with the most recent 'Last Updated' date.
     2.  **QUALITY/COMPLETENESS:** Suggest which page sounds like the primary, most official, or most comprehensive source.
@@ -147,16 +294,44 @@ def get_best_page_recommendation(matches, search_term):
     Example: 
     123456789
     Based on the analysis, I recommend page '123456789' (The Latest Policy Draft) because it is the most recent and the title suggests it is the official source...
+
+    Here are the details of the {len(match_keys)} pages found:
+    ---
+    {page_list}
+    ---
+
+    Search query: '{search_term}'
+    """
+    if _GEMINI_CLIENT is None:
+        raise RuntimeError("GEMINI_API_KEY environment variable not found.")
+    response = _GEMINI_CLIENT.models.generate_content(model=RANKING_MODEL, contents=prompt)
+    
+    lines = response.text.strip().split('\n', 1)
+    recommended_id = lines[0].strip()
+    recommendation_text = lines[1].strip() if len(lines) > 1 else "No detailed recommendation provided."
+    return recommended_id, recommendation_text
+
+
+def get_best_page_recommendation(matches, search_term):
+    """
+    Uses the Gemini model to recommend the best page for editing
+    based on perceived quality, latest date, and potential duplication.
     """
+    if len(matches) < LLM_RANKING_MIN_MATCHES:
+        latest_match = get_latest_updated_match(matches)
+        return f"Only {len(matches)} candidates found, so the Agent selected the **latest updated page**: **{latest_match['title']}**.", latest_match['id']
+    
+    # A clear local winner doesn't need the LLM; close calls still go to the listwise ranking
+    (best_score, best_match), (second_score, _) = score_matches(matches, search_term)[:2]
+    if best_score >= second_score * LOCAL_SCORE_MARGIN:
+        return f"**{best_match['title']}** is the clear best match by title relevance and recency, so the Agent selected it without a detailed analysis.", best_match['id']
+
+    # Hashable view of the candidates for the cached ranking call
+    match_keys = tuple((m['id'], m['title'], m['space_key'], m['last_updated']) for m in matches)
     try:
-        client = genai.Client(api_key=os.environ['GEMINI_API_KEY'])
-        response = client.models.generate_content(model='gemini-2.5-flash', contents=prompt)
-        
-        lines = response.text.strip().split('\n', 1)
-        recommended_id = lines[0].strip()
-        recommendation_text = lines[1].strip() if len(lines) > 1 else "No detailed recommendation provided."
+        recommended_id, recommendation_text = rank_pages_with_llm(match_keys, search_term)
         
-        if recommended_id in options_map:
+        if any(m['id'] == recommended_id for m in matches):
             return recommendation_text, recommended_id
         else:
             latest_match = get_latest_updated_match(matches)
@@ -167,89 +342,125 @@ def get_best_page_recommendation(matches, search_term):
         return f"Recommendation failed: {e}. Defaulting to the **latest updated page**: **{latest_match['title']}**.", latest_match['id']
 
 
-def get_corrected_page_proposal(page_title, page_content, action, search_term, update_focus, custom_notes, optional_instructions, output_format):
-    """Generates the proposed corrected content based on the user's selected action and updates token count."""
-    
-    action_prompts = {
-        'Fix Grammar & Spelling': 
-            "Review the page content and correct all grammatical errors, typos, and spelling mistakes. Do NOT change the meaning or structure. Return ONLY the corrected page content.",
-        
-        'Improve Formatting & Readability': 
-            "Review the page content (which is in Confluence Storage Format/HTML). Reformat it to be easier to read, using clear headings and lists. Do NOT change the meaning or core text. Return ONLY the improved page content.",
-            
-        'Propose Content Update':
-            f"Review the page content and propose a major update focusing on the search term '{search_term}'. Improve clarity, add missing steps, and make the information comprehensive. Include a brief summary of changes at the top. Return ONLY the proposed, fully updated page content.",
-        
-        'Just perform a Content Quality Audit (No changes proposed)': 
-            "You are a Content Quality Analyst. Analyze the page content and create a detailed Markdown report on its clarity, structure, completeness, and relevance to the search term. Do NOT propose a content change."
-    }
+def get_cached_page_context(client, model_name, page_id, page_block):
+    """
+    Returns the name of an explicit Gemini cache holding the page block, creating it
+    once per (model, page, content hash). Returns None when the page is too small to
+    cache or creation fails, in which case the caller sends the full prompt.
+    """
+    if len(page_block) // 4 < GEMINI_CACHE_MIN_TOKENS: # ~4 characters per token
+        return None
+
+    cache_key = (model_name, page_id, hashlib.sha256(page_block.encode()).hexdigest())
+    cached = st.session_state.gemini_cache.get(cache_key)
+    if cached and cached['expires'] > time.time():
+        return cached['name']
+
+    try:
+        cache = client.caches.create(
+            model=model_name,
+            config={
+                'contents': [{'role': 'user', 'parts': [{'text': page_block}]}],
+                'ttl': f"{GEMINI_CACHE_TTL_SECONDS}s"
+            }
+        )
+    except Exception:
+        return None
+
+    # Expire our reference a little early so we never send a cache that just lapsed
+    st.session_state.gemini_cache[cache_key] = {'name': cache.name, 'expires': time.time() + GEMINI_CACHE_TTL_SECONDS - 30}
+    return cache.name
+
+
+def get_corrected_page_proposal(page_id, page_title, page_content, action, search_term, update_focus, custom_notes, optional_instructions, output_format):
+    """
+    Streams the proposed corrected content for the user's selected action, yielding
+    text chunks as Gemini generates them, and updates the token count when done.
+    """
     
     # --- DYNAMIC PROMPT ADJUSTMENT ---
-    custom_instruction = ""
+    custom_parts = []
     # 1. Custom/New Content Strategy (only for Propose Content Update)
     if action == 'Propose Content Update' and update_focus == 'CUSTOM_INPUT' and custom_notes.strip():
-        custom_instruction += f"""
-        **CRITICAL NEW CONTENT INPUT:** Integrate the following specific, up-to-date information into the page content:
-        ---
-        CUSTOM CONTENT: {custom_notes}
-        ---
-        """
+        custom_parts.append(CUSTOM_CONTENT_TEMPLATE.substitute(custom_notes=custom_notes))
         
     # 2. General/Stylistic Instructions (for all actions)
     if optional_instructions.strip():
-        custom_instruction += f"""
-        **ADDITIONAL STYLISTIC/STRUCTURAL INSTRUCTIONS:** When performing the action, also ensure you follow these specific guidelines:
-        ---
-        GUIDELINES: {optional_instructions}
-        ---
-        """
+        custom_parts.append(GUIDELINES_TEMPLATE.substitute(optional_instructions=optional_instructions))
+    custom_instruction = "".join(custom_parts)
         
     # 3. Output Format Instruction
-    format_instruction = "The output must be formatted using **standard Markdown**."
-    
-    if output_format == "Confluence Storage Format (HTML/XML - For Direct Paste)":
-        format_instruction = "The output must be formatted using **Confluence Storage Format (HTML/XML)**. Do not include any Markdown text."
-    elif output_format == "Both Formats (Markdown & HTML/XML)":
-        format_instruction = """The output must contain TWO DISTINCT SECTIONS.
-        1. **MARKDOWN SECTION:** The full proposed content in standard Markdown format.
-        2. **HTML/XML SECTION:** The full proposed content converted into Confluence Storage Format (HTML/XML).
-        Use clear headings to separate the two sections (e.g., '## PROPOSED MARKDOWN' and '## PROPOSED HTML/XML')."""
+    format_instruction = FORMAT_INSTRUCTIONS.get(output_format, DEFAULT_FORMAT_INSTRUCTION)
 
+    action_template = ACTION_PROMPTS.get(action)
+    action_prompt = action_template.substitute(search_term=search_term) if action_template else 'Propose Content Update'
 
     # --- MODIFIED PROMPT WITH STRICT CONSTRAINT ---
-    prompt = f"""
-    You are an expert Confluence Content Editor. Your task is to perform the following action based on the details provided.
-    
-    **CRITICAL OUTPUT INSTRUCTION:** You MUST return **ONLY** the result of the action (the proposed content or audit report). Do not include any conversational preamble, confirmation, or explanatory text before the final output. {format_instruction}
-    
-    Action: '{action_prompts.get(action, 'Propose Content Update')}'
-    
-    PAGE TITLE: {page_title}
-    
-    {custom_instruction} 
-    
-    RAW PAGE CONTENT (in Confluence Storage Format/HTML):
-    ---
-    {page_content}
-    ---
-    """
+    page_block = PAGE_BLOCK_TEMPLATE.substitute(page_title=page_title, page_content=page_content)
+    task_prompt = TASK_PROMPT_TEMPLATE.substitute(
+        action_prompt=action_prompt,
+        custom_instruction=custom_instruction,
+        format_instruction=format_instruction
+    )
+
+    # Sent as separate parts so the large page block is never copied into a combined string
+    prompt_parts = [{'role': 'user', 'parts': [{'text': page_block}, {'text': task_prompt}]}]
     
     try:
-        client = genai.Client(api_key=os.environ['GEMINI_API_KEY'])
+        client = _GEMINI_CLIENT
+        if client is None:
+            raise RuntimeError("GEMINI_API_KEY environment variable not found.")
         model_name = 'gemini-2.5-pro' if action == 'Propose Content Update' else 'gemini-2.5-flash'
-        response = client.models.generate_content(model=model_name, contents=prompt)
-        
-        usage_metadata = response.usage_metadata
-        total_tokens = usage_metadata.prompt_token_count + usage_metadata.candidates_token_count
-        
-        st.session_state.total_tokens_used += total_tokens
-        st.session_state.token_usage = str(st.session_state.total_tokens_used)
+
+        cache_name = get_cached_page_context(client, model_name, page_id, page_block)
+        if cache_name:
+            # Only the small instruction delta is sent; the page comes from the cache
+            stream = client.models.generate_content_stream(
+                model=model_name,
+                contents=task_prompt,
+                config={'cached_content': cache_name}
+            )
+        else:
+            stream = client.models.generate_content_stream(model=model_name, contents=prompt_parts)
+
+        # Yield text as it is generated; usage metadata is complete on the final chunk
+        usage_metadata = None
+        for chunk in stream:
+            usage_metadata = chunk.usage_metadata or usage_metadata
+            if chunk.text:
+                yield chunk.text
         
-        return response.text
+        if usage_metadata:
+            # Cached tokens are billed at a steep discount, so count only the uncached prompt tokens
+            cached_tokens = usage_metadata.cached_content_token_count or 0
+            total_tokens = (usage_metadata.prompt_token_count or 0) - cached_tokens + (usage_metadata.candidates_token_count or 0)
+            
+            st.session_state.total_tokens_used += total_tokens
     except APIError as e:
-        return f"Proposal generation failed due to API Error: {e}"
+        yield f"Proposal generation failed due to API Error: {e}"
     except Exception as e:
-        return f"Proposal generation failed: {e}"
+        yield f"Proposal generation failed: {e}"
+
+
+@st.cache_data(max_entries=8, ttl=3600, show_spinner=False)
+def extract_markdown_section(text):
+    """Returns the Markdown section of a 'Both Formats' proposal, or None if it can't be isolated."""
+    # Plain substring scans instead of a DOTALL regex: the output can be large.
+    # Matches the old pattern: the Markdown header must end its line, and the
+    # HTML/XML header must start one.
+    md_header, html_header = '## PROPOSED MARKDOWN', '\n## PROPOSED HTML/XML'
+    markdown = None
+    md_start = text.find(md_header)
+    while md_start >= 0:
+        line_end = text.find('\n', md_start)
+        if line_end < 0:
+            break
+        if not text[md_start + len(md_header):line_end].strip():
+            html_start = text.find(html_header, line_end)
+            markdown = text[line_end:html_start if html_start >= 0 else len(text)].strip()
+            break
+        md_start = text.find(md_header, line_end)
+    return markdown
 
 
 # --- Callback Functions ---
@@ -273,9 +484,8 @@ def proceed_to_action_callback():
                 'step': 'choose_action' 
             })
             
+            # Streamlit reruns the script after a callback, so no explicit st.rerun() is needed
             st.session_state.submitted = False
-            
-            st.rerun()
         else:
             st.error("Error: Recommended page data is missing. Please clear history and try again.")
     else:
@@ -299,7 +509,7 @@ if st.sidebar.button("🧹 Clear All Results & History", type="secondary"):
     st.rerun()
 
 st.sidebar.markdown("### Status")
-st.sidebar.metric("Gemini API Tokens Used", st.session_state.token_usage)
+st.sidebar.metric("Gemini API Tokens Used", st.session_state.total_tokens_used)
 st.sidebar.markdown(f"**Target URL:**")
 st.sidebar.code(CONFLUENCE_BASE_URL, language='text')
 
@@ -351,8 +561,6 @@ if form_submitted or st.session_state.get('submitted', False):
     if form_submitted:
         if user_prompt not in st.session_state.search_history:
             st.session_state.search_history.append(user_prompt)
-            if len(st.session_state.search_history) > 5:
-                st.session_state.search_history.pop(0) 
         
         st.session_state.analysis_state = {}
         st.session_state.llm_selected_id = None
@@ -405,10 +613,24 @@ if st.session_state.analysis_state.get('step') == 'choose_page':
             st.warning(f"🤔 Found {total_matches} pages. The Agent will proceed with its **top recommendation**, but you can review the others.")
 
             with st.spinner("🧠 Analyzing page candidates for best quality and potential duplication..."):
-                recommendation_text, recommended_id = get_best_page_recommendation(
-                    matches, 
-                    st.session_state.analysis_state['search_term']
-                )
+                # Overlap the Confluence content fetches with the LLM ranking call
+                prefetch_ids = [m['id'] for m in matches[:PREFETCH_CANDIDATES]]
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    recommendation_future = executor.submit(
+                        get_best_page_recommendation,
+                        matches, 
+                        st.session_state.analysis_state['search_term']
+                    )
+                    # One batch call; the tool fetches the candidates concurrently on its shared client
+                    content_future = executor.submit(
+                        run_confluence_batch, [{'op': 'content', 'id': page_id} for page_id in prefetch_ids]
+                    )
+                    recommendation_text, recommended_id = recommendation_future.result()
+
+                st.session_state.analysis_state['content_cache'] = {
+                    page_id: content_data for page_id, content_data in zip(prefetch_ids, content_future.result())
+                    if "content" in content_data
+                }
             
             st.session_state.llm_selected_id = recommended_id
             
@@ -480,14 +702,9 @@ if st.session_state.analysis_state.get('step') == 'choose_action':
         # Use st.select to ensure we can control the default value on load
         action = st.radio(
             "Select Agent Task:",
-            [
-                "Propose Content Update",
-                "Improve Formatting & Readability",
-                "Fix Grammar & Spelling",
-                "Just perform a Content Quality Audit (No changes proposed)"
-            ],
+            _ACTIONS,
             key='selected_action',
-            index=["Propose Content Update", "Improve Formatting & Readability", "Fix Grammar & Spelling", "Just perform a Content Quality Audit (No changes proposed)"].index(action_type)
+            index=_ACTION_IDX.get(action_type, 0)
         )
         
         output_format = st.radio(
@@ -536,8 +753,11 @@ if st.session_state.analysis_state.get('step') == 'choose_action':
             'output_format': output_format 
         })
 
-        with st.spinner(f'Step 2/4: Retrieving full content for "{state["selected_title"]}"...'):
-            content_data = run_confluence_command(['--content-id', state['selected_id'], '--search', 'dummy']) 
+        # Use the content prefetched during page selection when available
+        content_data = state.get('content_cache', {}).get(state['selected_id'])
+        if content_data is None:
+            with st.spinner(f'Step 2/4: Retrieving full content for "{state["selected_title"]}"...'):
+                content_data = run_confluence_command(['--content-id', state['selected_id'], '--search', 'dummy']) 
         
         if "content" not in content_data:
             st.error(f"Content Retrieval Error: Could not get full page content.")
@@ -548,6 +768,8 @@ if st.session_state.analysis_state.get('step') == 'choose_action':
             'raw_content': content_data['content'],
             'step': 'analyze'
         })
+        # Rerun so State 3 streams the proposal without the action form still live above it;
+        # interacting with that form mid-stream would abort and restart a paid generation
         st.rerun()
 
 # --- State 3: Analyze & Propose ---
@@ -556,7 +778,9 @@ if st.session_state.analysis_state.get('step') == 'analyze':
     state = st.session_state.analysis_state
             
     with st.spinner(f'Step 3/4: Generating proposed content for "{state["action"]}"...'):
-        proposed_content = get_corrected_page_proposal(
+        # Render the proposal as it streams in; write_stream returns the full text
+        proposed_content = st.write_stream(get_corrected_page_proposal(
+            state['selected_id'],
             state['selected_title'], 
             state['raw_content'], 
             state['action'], 
@@ -565,7 +789,7 @@ if st.session_state.analysis_state.get('step') == 'analyze':
             state.get('custom_notes', ''),
             state.get('optional_instructions', ''),
             state.get('output_format', 'Markdown (Recommended for Review)')
-        )
+        ))
 
     st.session_state.analysis_state['proposed_content'] = proposed_content
     st.session_state.analysis_state['step'] = 'review_proposal'
@@ -585,8 +809,9 @@ if st.session_state.analysis_state.get('step') == 'review_proposal':
     if output_format == "Both Formats (Markdown & HTML/XML)":
         st.info("The Agent has generated the content in both Markdown and Confluence Storage Format. Check both tabs.")
         
-        match = re.search(r'## PROPOSED MARKDOWN\s*\n(.*?)(?=\n## PROPOSED HTML/XML|$)', state['proposed_content'], re.DOTALL)
-        markdown_content = match.group(1).strip() if match else "Could not isolate Markdown section. See Raw Content tab."
+        markdown_content = extract_markdown_section(state['proposed_content'])
+        if markdown_content is None:
+            markdown_content = "Could not isolate Markdown section. See Raw Content tab."
         raw_content_display = state['proposed_content']
         
     elif output_format == "Confluence Storage Format (HTML/XML - For Direct Paste)":
@@ -607,7 +832,10 @@ if st.session_state.analysis_state.get('step') == 'review_proposal':
         
     with tab2:
         language = 'html' if output_format in ["Confluence Storage Format (HTML/XML - For Direct Paste)", "Both Formats (Markdown & HTML/XML)"] else 'markdown'
-        st.code(raw_content_display, language=language, line_numbers=True)
+        # Behind a checkbox rather than an expander: expander children are always sent
+        # to the browser, whereas this skips the large payload until it is asked for
+        if st.checkbox("Show raw output", key='show_raw_output'):
+            st.code(raw_content_display, language=language, line_numbers=True)
     
     st.markdown("---")
     